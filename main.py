@@ -1,39 +1,122 @@
-import glob
 import logging
+import math
 import os
-from threading import Thread
+import time
+import shelve
+from functools import lru_cache, partial
+from threading import Lock, Thread
 
-from geopy.exc import GeocoderServiceError
+from geopy.adapters import RequestsAdapter
+from geopy.exc import GeocoderServiceError, GeocoderTimedOut
 from geopy.geocoders import Nominatim
 from kivy.animation import Animation
 from kivy.app import App
 from kivy.clock import Clock
 from kivy.garden.mapview import MapView, MapMarker, Coordinate, MapSource
+from kivy.garden.mapview.mapview.view import Tile
+from kivy.logger import Logger
 from kivy.properties import StringProperty, ObjectProperty, NumericProperty
 from kivy.storage.jsonstore import JsonStore
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.relativelayout import RelativeLayout
 from kivy.uix.screenmanager import Screen
-from landez import MBTilesBuilder
-from landez.sources import MBTilesReader
 from plyer import gps
 
 from confirmpopup import ConfirmPopup
-from mbtcsource import MBTilesCompositeMapSource
+from mbtbuilder import CustomMBTilesBuilder
+from mbtcsource import CustomMBTilesReader, MBTilesCompositeMapSource
 from mbtmerge import MbtMerge
 from popupmessage import PopupMessage
 
 __version__ = '0.1'
-logging.basicConfig(level=logging.DEBUG)
 app = None
 
 OFFLINE_CITY_MIN_ZOOM = 12
 OFFLINE_CITY_MAX_ZOOM = 15
 OFFLINE_WORLD_MIN_ZOOM = 0
 OFFLINE_WORLD_MAX_ZOOM = 5
+# GPS fixes closer than this (in seconds) don't move the map
+GPS_FIX_MIN_INTERVAL = 1.0
+EARTH_RADIUS = 6371008.8
 MBTILES_DIRECTORY_PATH = "mbtiles"
 MAIN_MBTILES_PATH = "main.mbtiles"
 JSON_STORE_PATH = "config.json"
+GEOCACHE_PATH = "geocache.db"
+MBTILES_INDEX_PATH = "mbtiles_index.json"
+GEOCODER_USER_AGENT = "GuyPS/%s" % (__version__)
+GEOCODER_TIMEOUT = 10
+# shared geocoder, the requests adapter keeps a session (and its sockets)
+# alive across lookups
+_GEOLOCATOR = Nominatim(
+    user_agent=GEOCODER_USER_AGENT, timeout=GEOCODER_TIMEOUT,
+    adapter_factory=RequestsAdapter)
+# geocoding threads may run concurrently, shelve isn't thread safe
+_GEOCACHE_LOCK = Lock()
+
+
+@lru_cache(maxsize=512)
+def _geocode_cached(text_norm):
+    """
+    Geocodes the normalized text, first looking up the on disk cache
+    so repeated searches don't hit Nominatim again, even across restarts.
+    """
+    geocache_path = App.get_running_app().geocache_path
+    with _GEOCACHE_LOCK, shelve.open(geocache_path) as shelf:
+        location = shelf.get(text_norm)
+    if location is None:
+        location = _GEOLOCATOR.geocode(text_norm)
+        # only persists found locations
+        if location is not None:
+            with _GEOCACHE_LOCK, shelve.open(geocache_path) as shelf:
+                shelf[text_norm] = location
+    return location
+
+
+def _do_geocode(text, callback):
+    """
+    Geocodes text in a background thread so the UI doesn't freeze.
+    callback(location, error) is then called from the main thread,
+    either location or error is None.
+    """
+    def geocode():
+        location, error = None, None
+        try:
+            location = _geocode_cached(text.strip().lower())
+        except (GeocoderServiceError, GeocoderTimedOut) as e:
+            error = e
+        Clock.schedule_once(lambda dt: callback(location, error), 0)
+    thread = Thread(target=geocode)
+    thread.daemon = True
+    thread.start()
+
+
+def haversine_distance(latitude1, longitude1, latitude2, longitude2):
+    """
+    Returns the great-circle distance in meters between two points.
+    """
+    lat1, lon1, lat2, lon2 = map(
+        math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def mbtiles_version(mbtiles_path):
+    """
+    Returns what identifies the mbtiles content: its mtime, plus its WAL
+    file mtime and size when changes weren't checkpointed yet.
+    The WAL file is empty or missing otherwise, e.g. readers create
+    an empty one, so both cases give the same version.
+    """
+    wal_version = [None, None]
+    try:
+        wal_stat = os.stat(mbtiles_path + '-wal')
+        if wal_stat.st_size > 0:
+            wal_version = [wal_stat.st_mtime, wal_stat.st_size]
+    except FileNotFoundError:
+        pass
+    # a list so it compares equal once loaded back from JSON
+    return [os.path.getmtime(mbtiles_path)] + wal_version
 
 
 class MbtMergeManager(object):
@@ -56,6 +139,9 @@ class MbtMergeManager(object):
         mbtmerge.merge(sources, destination)
         for source in sources:
             self.add_to_merged(source)
+        if sources:
+            mapview = App.get_running_app().controller.mapview_property
+            mapview.forget_mbtiles(sources + [destination])
 
     def not_merged(self):
         """
@@ -96,7 +182,19 @@ class MbtMergeManager(object):
 
 class GpsMarker(MapMarker):
 
+    def __init__(self, **kwargs):
+        # lat and lon usually change together, repositions once per frame
+        self._update_position_trigger = Clock.create_trigger(
+            self._do_update_position)
+        super(GpsMarker, self).__init__(**kwargs)
+
     def update_position(self):
+        """
+        Schedules a marker position update on map layer.
+        """
+        self._update_position_trigger()
+
+    def _do_update_position(self, dt=None):
         """
         Updates marker position on map layer.
         """
@@ -133,7 +231,8 @@ class OfflineMapsScreen(Screen):
         Lists *.mbtiles files and returns their basename.
         """
         filepaths = App.get_running_app().mbtiles_paths
-        filenames = [os.path.basename(x) for x in filepaths]
+        # Spinner.values is a ListProperty, a generator wouldn't do
+        filenames = list(map(os.path.basename, filepaths))
         return filenames
 
 
@@ -141,6 +240,8 @@ class CustomMapView(MapView):
     # default values
     DEFAULT_LATLON = (43.61, 3.88)
     DEFAULT_ZOOM = 8
+    # zoom property snaps to integers, no need for a 60fps animation
+    ZOOM_ANIMATION_STEP = 1 / 15.0
     # properties used for lat/lon animations
     animated_latlon_property = ObjectProperty()
     animated_zoom_property = NumericProperty()
@@ -150,12 +251,19 @@ class CustomMapView(MapView):
         Loads default lat/long and zoom values
         """
         super(CustomMapView, self).__init__(**kwargs)
+        self._app = App.get_running_app()
         # loads default values
         self.lat, self.lon = CustomMapView.DEFAULT_LATLON
         self.zoom = CustomMapView.DEFAULT_ZOOM
+        # last rounded lat/lon the animation centered on
+        self._last_center = None
         # updates animated properties with default values
         self.animated_latlon_property = Coordinate(self.lat, self.lon)
         self.animated_zoom_property = self.zoom
+        # map source keyed by mbtiles paths & versions
+        self._map_source_cache = {}
+        # mbtiles path -> (version, metadata)
+        self._meta_cache = {}
 
     def animated_diff_scale(self, d):
         """
@@ -208,15 +316,21 @@ class CustomMapView(MapView):
         anim = Animation(
             animated_zoom_property=zoom_out,
             duration=duration / 2.0,
-            t=transition)
+            t=transition,
+            step=CustomMapView.ZOOM_ANIMATION_STEP)
         anim += Animation(
             animated_zoom_property=zoom_in,
             duration=duration / 2.0,
-            t=transition)
+            t=transition,
+            step=CustomMapView.ZOOM_ANIMATION_STEP)
         anim.start(widget)
 
     def on_animated_zoom_property(self, instance, zoom):
-        self.zoom = int(zoom)
+        zoom = int(zoom)
+        # most animation frames don't cross an integer zoom
+        if zoom == self.zoom:
+            return
+        self.zoom = zoom
 
     def animated_center_on(self, latitude, longitude, zoom=None):
         """
@@ -230,6 +344,10 @@ class CustomMapView(MapView):
         zoom_out = 5
         duration = 2
         transition = 'in_out_expo'
+        # warms up the tiles the animation is about to go through
+        self.prefetch_tiles(
+            latitude, longitude,
+            {initial_zoom - 1, zoom_out, initial_zoom + 1})
         # zooms out and back in
         self.zoom_out_in(
             zoom_out, zoom_in=initial_zoom,
@@ -241,11 +359,49 @@ class CustomMapView(MapView):
             t=transition)
         anim.start(widget)
 
+    def prefetch_tiles(self, latitude, longitude, zooms):
+        """
+        Requests the tiles covering the viewport centered on lat/lon
+        for the given zoom levels, so they're cached once displayed.
+        Tiles are queued to the map source downloader, i.e. loaded
+        in background.
+        """
+        map_source = self.map_source
+        tile_size = map_source.dp_tile_size
+        # number of tiles from center to the viewport edges
+        half_cols = int(self.width / tile_size / 2) + 1
+        half_rows = int(self.height / tile_size / 2) + 1
+        for zoom in zooms:
+            if not map_source.min_zoom <= zoom <= map_source.max_zoom:
+                continue
+            center_x = int(map_source.get_x(zoom, longitude) / tile_size)
+            center_y = int(map_source.get_y(zoom, latitude) / tile_size)
+            max_x = map_source.get_col_count(zoom) - 1
+            max_y = map_source.get_row_count(zoom) - 1
+            for tile_x in range(
+                    max(center_x - half_cols, 0),
+                    min(center_x + half_cols, max_x) + 1):
+                for tile_y in range(
+                        max(center_y - half_rows, 0),
+                        min(center_y + half_rows, max_y) + 1):
+                    tile = Tile(
+                        size=(tile_size, tile_size),
+                        cache_dir=map_source.cache_dir)
+                    tile.map_source = map_source
+                    tile.zoom = zoom
+                    tile.tile_x = tile_x
+                    tile.tile_y = tile_y
+                    tile.state = "loading"
+                    map_source.fill_tile(tile)
+
     def on_animated_latlon_property(self, instance, coordinate):
-        # coordinate somehow lost its type
-        coordinate = Coordinate(coordinate[0], coordinate[1])
-        latitude = coordinate.lat
-        longitude = coordinate.lon
+        # coordinate somehow lost its type, i.e. (lat, lon)
+        latitude, longitude = coordinate[0], coordinate[1]
+        # skips sub-meter moves
+        center = (round(latitude, 5), round(longitude, 5))
+        if center == self._last_center:
+            return
+        self._last_center = center
         self.center_on(latitude, longitude)
 
     def on_touch_down(self, touch):
@@ -254,13 +410,16 @@ class CustomMapView(MapView):
         return super(CustomMapView, self).on_touch_down(touch)
 
     def search(self, text):
-        geolocator = Nominatim()
-        try:
-            location = geolocator.geocode(text)
-        except GeocoderServiceError as e:
+        """
+        Looks up the location in background and moves to it when found.
+        """
+        _do_geocode(text, self._on_search_geocoded)
+
+    def _on_search_geocoded(self, location, error):
+        if error is not None:
             popup = PopupMessage(
                 title="Error",
-                body=e.message)
+                body=str(error))
             popup.open()
             return
         if location is None:
@@ -280,24 +439,104 @@ class CustomMapView(MapView):
         """
         mbt_merge_manager = MbtMergeManager()
         not_merged_mbtiles = mbt_merge_manager.not_merged()
-        main_mbtiles_path = App.get_running_app().main_mbtiles_path
+        main_mbtiles_path = self._app.main_mbtiles_path
         # not yet merged *.mbtiles plus main one
         mbtiles_paths = not_merged_mbtiles + [main_mbtiles_path]
         # requested mbtiles path
         mbtiles_path = os.path.join(
-            App.get_running_app().mbtiles_directory, mbtiles)
-        map_source = MBTilesCompositeMapSource(mbtiles_paths)
-        self.map_source = map_source
-        mbreader = MBTilesReader(mbtiles_path)
+            self._app.mbtiles_directory, mbtiles)
+        self.map_source = self._composite_map_source(mbtiles_paths)
         # centers on requested loaded mbtiles
-        metadata = mbreader.metadata()
+        metadata = self._mbtiles_metadata(mbtiles_path)
         if "center" in metadata:
             center = metadata["center"]
-            longitude, latitude, default_zoom = map(float, center.split(","))
-        # defaults to the minimum available zoom
+            longitude, latitude, default_zoom = map(
+                float, center.split(",", 2))
+        else:
+            bounds = metadata.get("bounds")
+            if bounds:
+                # centers on the bounding box
+                left, bottom, right, top = map(float, bounds.split(","))
+                latitude = (bottom + top) / 2.0
+                longitude = (left + right) / 2.0
+            else:
+                latitude, longitude = CustomMapView.DEFAULT_LATLON
+            # defaults to the minimum available zoom
+            default_zoom = metadata.get("minzoom", CustomMapView.DEFAULT_ZOOM)
         zoom = int(default_zoom)
         self.animated_center_on(latitude, longitude, zoom)
 
+    def _composite_map_source(self, mbtiles_paths):
+        """
+        Returns the composite map source for the given mbtiles paths.
+        Reuses the previous one as long as none of the files changed.
+        """
+        key = tuple(
+            (path, tuple(mbtiles_version(path)))
+            for path in sorted(mbtiles_paths))
+        map_source = self._map_source_cache.get(key)
+        if map_source is None:
+            mbtiles_index = self._mbtiles_index(mbtiles_paths)
+            map_source = MBTilesCompositeMapSource(mbtiles_index)
+            # only keeps the latest one, it holds opened sqlite connections
+            self._map_source_cache = {key: map_source}
+        return map_source
+
+    def _mbtiles_index(self, mbtiles_paths):
+        """
+        Returns the (path, min zoom, max zoom, bounds) index of the mbtiles.
+        The index is persisted so files don't get opened on next launches.
+        """
+        store = JsonStore(self._app.mbtiles_index_path)
+        mbtiles_index = []
+        for path in mbtiles_paths:
+            version = mbtiles_version(path)
+            if (store.exists(path) and
+                    store.get(path).get('version') == version):
+                entry = store.get(path)
+                min_zoom, max_zoom = entry['min_zoom'], entry['max_zoom']
+                bounds = entry['bounds']
+            else:
+                metadata = self._mbtiles_metadata(path)
+                min_zoom = int(metadata["minzoom"])
+                max_zoom = int(metadata["maxzoom"])
+                bounds = None
+                if "bounds" in metadata:
+                    bounds = list(map(float, metadata["bounds"].split(",")))
+                store.put(
+                    path, version=version, min_zoom=min_zoom,
+                    max_zoom=max_zoom, bounds=bounds)
+            if bounds is not None:
+                bounds = tuple(bounds)
+            mbtiles_index.append((path, min_zoom, max_zoom, bounds))
+        return mbtiles_index
+
+    def _mbtiles_metadata(self, mbtiles_path):
+        """
+        Returns the mbtiles metadata, cached until the file changes.
+        """
+        version = mbtiles_version(mbtiles_path)
+        cached_version, metadata = self._meta_cache.get(
+            mbtiles_path, (None, None))
+        if version != cached_version:
+            metadata = CustomMBTilesReader(mbtiles_path).metadata()
+            # only keeps the latest version of each file
+            self._meta_cache[mbtiles_path] = (version, metadata)
+        return metadata
+
+    def forget_mbtiles(self, mbtiles_paths):
+        """
+        Drops the cached map source, metadata and index of the mbtiles,
+        e.g. after they got merged.
+        """
+        self._map_source_cache = {}
+        for path in mbtiles_paths:
+            self._meta_cache.pop(path, None)
+        store = JsonStore(self._app.mbtiles_index_path)
+        for path in mbtiles_paths:
+            if store.exists(path):
+                store.delete(path)
+
     def load_default_map_source(self):
         """
         Switch back to default MapSource online map.
@@ -311,23 +550,30 @@ class Toolbar(BoxLayout):
 
     def __init__(self, **kwargs):
         super(Toolbar, self).__init__(**kwargs)
+        # reused rather than recreated on every show/hide
+        self._show_anim = Animation(alpha_color=Toolbar.MAX_ALPHA, duration=1)
+        self._hide_anim = Animation(alpha_color=0, duration=1)
         self.show(animated=False)
 
-    def show(self, animated=True):
+    def _animate_alpha_to(self, alpha_color, anim, animated):
+        """
+        Stops any running alpha animation and moves to the target alpha.
+        """
+        # cancels first, an animation heading the other way may not
+        # have moved the alpha yet
+        Animation.cancel_all(self, 'alpha_color')
+        if self.alpha_color == alpha_color:
+            return
         if animated:
-            widget = self
-            anim = Animation(alpha_color=Toolbar.MAX_ALPHA, duration=1)
-            anim.start(widget)
+            anim.start(self)
         else:
-            self.alpha_color = Toolbar.MAX_ALPHA
+            self.alpha_color = alpha_color
+
+    def show(self, animated=True):
+        self._animate_alpha_to(Toolbar.MAX_ALPHA, self._show_anim, animated)
 
     def hide(self, animated=True):
-        if animated:
-            widget = self
-            anim = Animation(alpha_color=0, duration=1)
-            anim.start(widget)
-        else:
-            self.alpha_color = 0
+        self._animate_alpha_to(0, self._hide_anim, animated)
 
 
 class MapViewScreen(Screen):
@@ -338,19 +584,21 @@ class MapViewScreen(Screen):
     def __init__(self, **kwargs):
         super(MapViewScreen, self).__init__(**kwargs)
         # starts by default without the status message bar
-        Clock.schedule_once(
-            lambda dt: self.status_bar_property.hide(animated=False), 0)
+        Clock.schedule_once(self._initial_hide_status, 0)
+        # re-arming a trigger is cheaper than unscheduling a callback
+        self._clean_trigger = Clock.create_trigger(
+            self._clean_status_message, 3)
+
+    def _initial_hide_status(self, dt=None):
+        self.status_bar_property.hide(animated=False)
 
     def update_status_message(self, text, lifetime=3):
         self.status_bar_property.show()
         self.status_message = text
-        # http://kivy.org/docs/api-kivy.clock.html
-        # You cannot unschedule an anonymous function unless you keep
-        # a reference to it.
-        # It's better to add *args to your function definition
-        # so that it can be called with an arbitrary number of parameters.
-        Clock.unschedule(self._clean_status_message)
-        Clock.schedule_once(self._clean_status_message, lifetime)
+        # restarts the countdown, a pending trigger wouldn't be rescheduled
+        self._clean_trigger.cancel()
+        self._clean_trigger.timeout = lifetime
+        self._clean_trigger()
 
     def _clean_status_message(self, dt=None):
         self.status_message = ""
@@ -363,20 +611,26 @@ class Controller(RelativeLayout):
 
     def __init__(self, **kwargs):
         super(Controller, self).__init__(**kwargs)
+        self._app = App.get_running_app()
         self.gps_marker = None
+        # last GPS fix the map got centered on
+        self._last_fix_time = None
+        self._last_fix_latlon = None
         self.mapview_property = self.mapview_screen_property.ids['mapview']
         self.bind_events()
 
     def bind_events(self):
         search_input = self.mapview_screen_property.search_input_property
-        search_input.bind(
-            on_text_validate=lambda obj: self.on_search(search_input.text))
+        search_input.bind(on_text_validate=self._on_search_validate)
         # mapview = self.mapview_property
         # mapview_screen = self.mapview_screen_property
         # mapview.bind(
         #     zoom=lambda obj, zoom: mapview_screen.update_status_message(
         #         "Zoom level %s" % (zoom)))
 
+    def _on_search_validate(self, instance):
+        self.on_search(instance.text)
+
     def gps_not_found_message(self):
         """
         Shows a "GPS not found" status bar and popup error message.
@@ -411,6 +665,8 @@ class Controller(RelativeLayout):
         if self.gps_marker is not None:
             mapview.remove_marker(self.gps_marker)
             self.gps_marker = None
+        self._last_fix_time = None
+        self._last_fix_latlon = None
 
     def toggle_gps_localize(self, start):
         if start:
@@ -430,11 +686,35 @@ class Controller(RelativeLayout):
         else:
             self.gps_marker.lat = latitude
             self.gps_marker.lon = longitude
+        if not self.is_significant_fix(latitude, longitude):
+            return
+        self._last_fix_time = time.monotonic()
+        self._last_fix_latlon = (latitude, longitude)
         mapview.animated_center_on(latitude, longitude)
         mapview_screen.update_status_message(
             "Latitude: %s / Longitude: %s" %
             (round(latitude, 2), round(longitude, 2)), 10)
 
+    def is_significant_fix(self, latitude, longitude):
+        """
+        Returns True if the map should be moved to this GPS fix, i.e.
+        the previous move is old enough and the location moved
+        by more than a quarter of a tile.
+        """
+        if self._last_fix_time is None:
+            return True
+        if time.monotonic() - self._last_fix_time < GPS_FIX_MIN_INTERVAL:
+            return False
+        mapview = self.mapview_property
+        last_latitude, last_longitude = self._last_fix_latlon
+        # ground size of a tile at this latitude and zoom
+        tile_size = (
+            2 * math.pi * EARTH_RADIUS * math.cos(math.radians(latitude)) /
+            2 ** mapview.zoom)
+        distance = haversine_distance(
+            last_latitude, last_longitude, latitude, longitude)
+        return distance >= tile_size / 4
+
     def on_status(self, stype, status):
         mapview_screen = self.mapview_screen_property
         mapview_screen.update_status_message(
@@ -449,7 +729,7 @@ class Controller(RelativeLayout):
         Changes geopy bbox to mbtiles bbox.
         """
         # bottom, top, left, right
-        (min_lat, max_lat, min_lon, max_lon) = [float(x) for x in geopy_bbox]
+        (min_lat, max_lat, min_lon, max_lon) = map(float, geopy_bbox)
         bbox = (min_lon, min_lat, max_lon, max_lat)
         return bbox
 
@@ -457,9 +737,17 @@ class Controller(RelativeLayout):
         """
         Verifes location requested for download is valid,
         i.e. exists and is allowed (city only).
+        The location is looked up in background.
         """
-        geolocator = Nominatim()
-        location = geolocator.geocode(text)
+        _do_geocode(text, self._on_download_geocoded)
+
+    def _on_download_geocoded(self, location, error):
+        if error is not None:
+            popup = PopupMessage(
+                title="Error",
+                body=str(error))
+            popup.open()
+            return
         if location is None:
             popup = PopupMessage(
                 title="Error",
@@ -477,7 +765,7 @@ class Controller(RelativeLayout):
         mapview = self.mapview_property
         mapview.animated_center_on(location.latitude, location.longitude)
         # exctracts the city from the address string
-        city = location.address.split(',')[0]
+        city = location.address.split(',', 1)[0]
         # changes geopy bounding box format to landez one
         geopy_bbox = location.raw['boundingbox']
         filename = city + '.mbtiles'
@@ -487,13 +775,10 @@ class Controller(RelativeLayout):
 
     def prepare_download_for_offline2(self, filename, bbox, zoomlevels):
         """
-        Verifies the file system is ready for this download.
-        Checks the directory are created, verifies if the file already exists.
+        Verifies the file system is ready for this download,
+        i.e. verifies if the file already exists.
         """
-        if not os.path.exists(App.get_running_app().mbtiles_directory):
-            os.makedirs(App.get_running_app().mbtiles_directory)
-        filepath = os.path.join(
-            App.get_running_app().mbtiles_directory, filename)
+        filepath = os.path.join(self._app.mbtiles_directory, filename)
         if os.path.exists(filepath):
             popup = ConfirmPopup(
                 title="File already exists",
@@ -515,14 +800,12 @@ class Controller(RelativeLayout):
             os.remove(filepath)
             mbt_merge_manager = MbtMergeManager()
             mbt_merge_manager.remove_from_merged(filepath)
-        mb = MBTilesBuilder(filepath=filepath, cache=True)
+        mb = CustomMBTilesBuilder(filepath=filepath, cache=True)
         mb.add_coverage(bbox=bbox,
                         zoomlevels=zoomlevels)
-        mb_run_thread = Thread(target=mb.run, kwargs={'force': False})
-        mb_run_thread.start()
-        Clock.schedule_interval(
-            lambda dt: self.probe_mb_tiles_builder_thread(
-                mb, mb_run_thread), 0.5)
+        probe_thread = Thread(
+            target=self.probe_mb_tiles_builder_thread, args=(mb,))
+        probe_thread.start()
 
     def download_world_map(self):
         """
@@ -533,17 +816,30 @@ class Controller(RelativeLayout):
         zoomlevels = range(OFFLINE_WORLD_MIN_ZOOM, OFFLINE_WORLD_MAX_ZOOM + 1)
         self.prepare_download_for_offline2(filename, bbox, zoomlevels)
 
-    def probe_mb_tiles_builder_thread(self, mb, mb_run_thread):
+    def probe_mb_tiles_builder_thread(self, mb):
         """
-        Probes tiles downloading.
+        Runs the tiles download and probes its progress.
+        Runs in the background, the status message only gets updated
+        from the main thread when the progress changes.
         """
+        mb_run_thread = Thread(target=mb.run, kwargs={'force': False})
+        mb_run_thread.start()
+        progress = None
+        while mb_run_thread.is_alive():
+            if mb.progress() != progress:
+                progress = mb.progress()
+                Clock.schedule_once(partial(
+                    self.update_download_status_message,
+                    progress, mb.nbtiles), 0)
+            mb_run_thread.join(0.5)
+        Clock.schedule_once(partial(
+            self.update_download_status_message,
+            mb.nbtiles, mb.nbtiles), 0)
+
+    def update_download_status_message(self, rendered, nbtiles, dt=None):
         mapview_screen = self.mapview_screen_property
         mapview_screen.update_status_message(
-            "Downloading tiles %s/%s" % (mb.rendered, mb.nbtiles), 10)
-        if not mb_run_thread.is_alive():
-            mapview_screen.update_status_message(
-                "Downloading tiles %s/%s" % (mb.nbtiles, mb.nbtiles), 10)
-            return False
+            "Downloading tiles %s/%s" % (rendered, nbtiles), 10)
 
     def load_mbtiles(self, mbtiles):
         """
@@ -564,6 +860,16 @@ class MapViewApp(App):
     def build(self):
         global app
         app = self
+        # debug logging is opt-in, it slows down every log call
+        debug = os.environ.get('GUYPS_DEBUG')
+        # Kivy replaces the root logger with its own, which already has
+        # handlers, so logging.basicConfig() would have no effect
+        Logger.setLevel(logging.DEBUG if debug else logging.INFO)
+        self.mbtiles_directory = os.path.join(
+            self.user_data_dir, MBTILES_DIRECTORY_PATH)
+        os.makedirs(self.mbtiles_directory, exist_ok=True)
+        # (mbtiles directory mtime, mbtiles paths)
+        self._mbtiles_cache = (None, [])
         self.controller = Controller()
         return self.controller
 
@@ -579,28 +885,46 @@ class MapViewApp(App):
         return os.path.join(self.user_data_dir, JSON_STORE_PATH)
 
     @property
-    def main_mbtiles_path(self):
+    def mbtiles_index_path(self):
         """
-        Returns the merged mbtiles file path.
+        Returns the mbtiles zoom levels and bounds index file path.
         """
-        return os.path.join(self.user_data_dir, MAIN_MBTILES_PATH)
+        return os.path.join(self.user_data_dir, MBTILES_INDEX_PATH)
 
     @property
-    def mbtiles_directory(self):
+    def geocache_path(self):
         """
-        Returns the mbtiles directory.
+        Returns the geocoding cache file path.
         """
-        return os.path.join(self.user_data_dir, MBTILES_DIRECTORY_PATH)
+        return os.path.join(self.user_data_dir, GEOCACHE_PATH)
+
+    @property
+    def main_mbtiles_path(self):
+        """
+        Returns the merged mbtiles file path.
+        """
+        return os.path.join(self.user_data_dir, MAIN_MBTILES_PATH)
 
     @property
     def mbtiles_paths(self):
         """
         Returns the list of mbtiles files paths.
+        The listing is cached until the directory modification time changes.
         """
-        filepath = os.path.join(
-            self.mbtiles_directory, u'*.mbtiles')
-        filepaths = glob.glob(filepath)
-        return filepaths
-
-
-MapViewApp().run()
+        mbtiles_directory = self.mbtiles_directory
+        try:
+            mtime = os.stat(mbtiles_directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        cached_mtime, filepaths = self._mbtiles_cache
+        if mtime != cached_mtime:
+            filepaths = [
+                entry.path for entry in os.scandir(mbtiles_directory)
+                if entry.name.endswith('.mbtiles')]
+            self._mbtiles_cache = (mtime, filepaths)
+        # callers may alter the returned list
+        return list(filepaths)
+
+
+if __name__ == '__main__':
+    MapViewApp().run()
@@ -0,0 +1,88 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from threading import Lock
+
+from kivy.logger import Logger
+from landez import MBTilesBuilder
+from landez.cache import Dummy
+from landez.proj import GoogleProjection
+
+DOWNLOAD_WORKERS = 8
+
+
+@lru_cache(maxsize=32)
+def coverage_tiles(bbox, zoomlevels, tile_size, tile_scheme):
+    """
+    Returns the (z, x, y) tiles covering the bounding box on zoom levels.
+    Cached since the tiles count grows as 4^z.
+    """
+    proj = GoogleProjection(tile_size, list(zoomlevels), tile_scheme)
+    return tuple(proj.tileslist(bbox))
+
+
+class CustomMBTilesBuilder(MBTilesBuilder):
+    """
+    MBTilesBuilder reusing the coverage computed by previous downloads
+    and downloading tiles in parallel.
+    """
+
+    def __init__(self, **kwargs):
+        self.max_workers = kwargs.pop('max_workers', DOWNLOAD_WORKERS)
+        super(CustomMBTilesBuilder, self).__init__(**kwargs)
+        # number of tiles the pool went through, rendered is left to landez
+        self.prefetched = 0
+        self._prefetched_lock = Lock()
+        self._prefetch = False
+
+    def progress(self):
+        """
+        Returns the number of tiles downloaded so far.
+        """
+        if self._prefetch:
+            return self.prefetched
+        return self.rendered
+
+    def tileslist(self, bbox, zoomlevels):
+        return coverage_tiles(
+            tuple(bbox), tuple(zoomlevels), self.tile_size, self.tile_scheme)
+
+    def _prefetch_tile(self, tile):
+        """
+        Downloads the tile to the cache, errors are ignored since
+        the tile gets downloaded again when packaging.
+        """
+        try:
+            self.tile(tile)
+        except Exception as e:
+            Logger.debug(
+                "CustomMBTilesBuilder: prefetching tile %s failed: %s" % (
+                    tile, e))
+        with self._prefetched_lock:
+            self.prefetched += 1
+
+    def run(self, force=False):
+        """
+        Downloads the tiles to the cache using a pool of threads,
+        then lets MBTilesBuilder package them from the cache.
+        """
+        # without cache, tiles would get downloaded twice
+        self._prefetch = not isinstance(self.cache, Dummy) and (
+            force or not os.path.exists(self.filepath))
+        if self._prefetch:
+            tileslist = set()
+            for bbox, levels in self._bboxes:
+                tileslist.update(self.tileslist(bbox, levels))
+            self.nbtiles = len(tileslist)
+            self.prefetched = 0
+            # workers would race creating the same directories
+            tile_dirs = set(
+                os.path.dirname(self.cache.tile_fullpath(tile))
+                for tile in tileslist)
+            for tile_dir in tile_dirs:
+                os.makedirs(tile_dir, exist_ok=True)
+            # only tiles coordinates are queued, contents go to the cache
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for tile in tileslist:
+                    executor.submit(self._prefetch_tile, tile)
+        super(CustomMBTilesBuilder, self).run(force=force)
@@ -1,36 +1,211 @@
+import io
+import math
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.request import pathname2url
+
+from kivy.core.image import Image as CoreImage
 from kivy.garden.mapview.mapview.mbtsource import MBTilesMapSource
+from landez.sources import MBTilesReader
+
+# read connections get memory mapped and larger page cache
+SQLITE_READ_PRAGMAS = (
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+)
+# recently loaded tiles contents are kept in memory up to this size
+TILE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def tile_latitude(zoom, xyz_y):
+    """
+    Returns the latitude of the top edge of an XYZ tile row.
+    """
+    n = math.pi * (1 - 2 * xyz_y / 2.0 ** zoom)
+    return math.degrees(math.atan(math.sinh(n)))
+
+
+def tile_bounds(zoom, tile_x, tile_y):
+    """
+    Returns the (left, bottom, right, top) lon/lat bounds of a TMS tile.
+    """
+    n = 2.0 ** zoom
+    left = tile_x / n * 360.0 - 180.0
+    right = (tile_x + 1) / n * 360.0 - 180.0
+    # TMS rows start from the bottom
+    xyz_y = n - 1 - tile_y
+    top = tile_latitude(zoom, xyz_y)
+    bottom = tile_latitude(zoom, xyz_y + 1)
+    return (left, bottom, right, top)
+
+
+def connect_readonly(filename):
+    """
+    Opens a read only sqlite connection tuned for reading tiles,
+    so multiple readers can share the file.
+    """
+    uri = "file:%s?mode=ro" % pathname2url(os.path.abspath(filename))
+    db = sqlite3.connect(uri, uri=True)
+    for pragma in SQLITE_READ_PRAGMAS:
+        db.execute(pragma)
+    return db
+
+
+class CustomMBTilesReader(MBTilesReader):
+    """
+    MBTilesReader using a read only tuned connection.
+    """
+
+    def _query(self, sql, *args):
+        if not self._con:
+            self._con = connect_readonly(self.filename)
+            self._cur = self._con.cursor()
+        return super(CustomMBTilesReader, self)._query(sql, *args)
+
+
+class CustomMBTilesMapSource(MBTilesMapSource):
+    """
+    MBTilesMapSource keeping one read only tuned connection per thread
+    rather than reconnecting for every tile.
+    """
+
+    def __init__(self, filename, **kwargs):
+        super(CustomMBTilesMapSource, self).__init__(filename, **kwargs)
+        self._thread_local = threading.local()
+
+    def read_tile_data(self, tile):
+        """
+        Returns the tile image content or None if it's not in the file.
+        """
+        db = getattr(self._thread_local, "db", None)
+        if db is None:
+            db = self._thread_local.db = connect_readonly(self.filename)
+        c = db.cursor()
+        c.execute(
+            ("SELECT tile_data FROM tiles WHERE "
+             "zoom_level=? AND tile_column=? AND tile_row=?"),
+            (tile.zoom, tile.tile_x, tile.tile_y))
+        row = c.fetchone()
+        if not row:
+            return None
+        # row[0] may not support the buffer interface on Android
+        return bytes(row[0])
+
+    def load_tile_data(self, tile, data):
+        """
+        Loads the tile image from its content.
+        """
+        im = CoreImage(
+            io.BytesIO(data), ext='png',
+            filename="{}.{}.{}.png".format(
+                tile.zoom, tile.tile_x, tile.tile_y))
+        if im is None:
+            tile.state = "done"
+            return
+        return self._load_tile_done, (tile, im, )
+
+    def _load_tile(self, tile):
+        data = self.read_tile_data(tile)
+        if data is None:
+            tile.state = "done"
+            return
+        return self.load_tile_data(tile, data)
 
 
 class MBTilesCompositeMapSource(MBTilesMapSource):
     """
     Handles multiple MBTilesMapSource as one.
+    Tiles are only looked up in the files covering their zoom and bounds,
+    files get opened on first use.
     """
 
-    def __init__(self, filenames):
-        super(MBTilesCompositeMapSource, self).__init__(filenames[0])
-        self.filenames = filenames
-        self.mbtiles_map_sources = []
-        for filename in filenames:
-            mbtiles_map_source = MBTilesMapSource(filename)
-            self.mbtiles_map_sources.append(mbtiles_map_source)
+    def __init__(self, mbtiles_index):
+        """
+        mbtiles_index is a list of (filename, min_zoom, max_zoom, bounds),
+        bounds being None when unknown.
+        """
+        self.filenames = [entry[0] for entry in mbtiles_index]
+        super(MBTilesCompositeMapSource, self).__init__(self.filenames[0])
+        # zoom level -> [(filename, bounds), ...], keeps files order
+        self.zoom_index = {}
+        for filename, min_zoom, max_zoom, bounds in mbtiles_index:
+            for zoom in range(min_zoom, max_zoom + 1):
+                self.zoom_index.setdefault(zoom, []).append(
+                    (filename, bounds))
+        self.mbtiles_map_sources = {}
+        self._mbtiles_map_sources_lock = threading.Lock()
+        # (filename, zoom, x, y) -> tile content, least recently used first
+        self._tile_cache = OrderedDict()
+        self._tile_cache_size = 0
+        self._tile_cache_lock = threading.Lock()
         # merges meta data of all map sources
-        self.min_zoom = min(
-            [map_source.min_zoom for map_source in self.mbtiles_map_sources])
-        self.max_zoom = max(
-            [map_source.max_zoom for map_source in self.mbtiles_map_sources])
+        self.min_zoom = min([entry[1] for entry in mbtiles_index])
+        self.max_zoom = max([entry[2] for entry in mbtiles_index])
         # creates the largest bounding box that contains them all
-        left = min(
-            [map_source.bounds[0] for map_source in self.mbtiles_map_sources])
-        bottom = min(
-            [map_source.bounds[1] for map_source in self.mbtiles_map_sources])
-        right = max(
-            [map_source.bounds[2] for map_source in self.mbtiles_map_sources])
-        top = max(
-            [map_source.bounds[3] for map_source in self.mbtiles_map_sources])
-        self.bounds = (left, bottom, right, top)
+        all_bounds = [
+            entry[3] for entry in mbtiles_index if entry[3] is not None]
+        if all_bounds:
+            left = min([bounds[0] for bounds in all_bounds])
+            bottom = min([bounds[1] for bounds in all_bounds])
+            right = max([bounds[2] for bounds in all_bounds])
+            top = max([bounds[3] for bounds in all_bounds])
+            self.bounds = (left, bottom, right, top)
+
+    def _mbtiles_map_source(self, filename):
+        """
+        Returns the map source of the file, opens it if needed.
+        Tiles are loaded from multiple threads.
+        """
+        with self._mbtiles_map_sources_lock:
+            mbtiles_map_source = self.mbtiles_map_sources.get(filename)
+            if mbtiles_map_source is None:
+                mbtiles_map_source = CustomMBTilesMapSource(filename)
+                self.mbtiles_map_sources[filename] = mbtiles_map_source
+        return mbtiles_map_source
+
+    def _candidate_filenames(self, tile):
+        """
+        Yields the files that may contain the tile.
+        """
+        left, bottom, right, top = tile_bounds(
+            tile.zoom, tile.tile_x, tile.tile_y)
+        for filename, bounds in self.zoom_index.get(tile.zoom, []):
+            if (bounds is None or (
+                    left <= bounds[2] and right >= bounds[0] and
+                    bottom <= bounds[3] and top >= bounds[1])):
+                yield filename
+
+    def _tile_data(self, filename, tile):
+        """
+        Returns the tile content from the file, or None if it's not there.
+        Recently read contents are served from memory.
+        """
+        key = (filename, tile.zoom, tile.tile_x, tile.tile_y)
+        with self._tile_cache_lock:
+            data = self._tile_cache.get(key)
+            if data is not None:
+                self._tile_cache.move_to_end(key)
+                return data
+        mbtiles_map_source = self._mbtiles_map_source(filename)
+        data = mbtiles_map_source.read_tile_data(tile)
+        if data is None:
+            return None
+        with self._tile_cache_lock:
+            if key not in self._tile_cache:
+                self._tile_cache[key] = data
+                self._tile_cache_size += len(data)
+            while self._tile_cache_size > TILE_CACHE_MAX_BYTES:
+                _, evicted = self._tile_cache.popitem(last=False)
+                self._tile_cache_size -= len(evicted)
+        return data
 
     def _load_tile(self, tile):
-        for mbtiles_map_source in self.mbtiles_map_sources:
-            ret = mbtiles_map_source._load_tile(tile)
-            if ret is not None:
-                return ret
+        for filename in self._candidate_filenames(tile):
+            data = self._tile_data(filename, tile)
+            if data is not None:
+                mbtiles_map_source = self._mbtiles_map_source(filename)
+                return mbtiles_map_source.load_tile_data(tile, data)
+        tile.state = "done"
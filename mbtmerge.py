@@ -5,27 +5,54 @@ import argparse
 from shutil import copyfile
 
 
+# WAL lets readers keep reading while merging and skips most fsync calls
+SQLITE_WRITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
 class MbtMerge(object):
     """
     Handles mbtiles merging.
     """
 
+    def _connect(self, destination):
+        """
+        Opens a write connection tuned for merging.
+        """
+        conn = sqlite3.connect(destination)
+        for pragma in SQLITE_WRITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _close(self, conn):
+        """
+        Checkpoints the WAL back into the database file before closing.
+        Readers may keep the file opened, so closing wouldn't checkpoint,
+        leaving the file (and its mtime) untouched.
+        The WAL gets truncated, only a non empty one means pending changes.
+        """
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+
     def _merge_tiles_table(self, source, destination):
         """
         Merges tiles table from source to destination.
         """
-        conn = sqlite3.connect(destination)
+        conn = self._connect(destination)
         cursor = conn.cursor()
         cursor.execute("ATTACH '%s' as db2" % (source))
         cursor.execute("INSERT OR IGNORE INTO tiles SELECT * FROM db2.tiles")
         conn.commit()
-        conn.close()
+        self._close(conn)
 
     def _merge_metadata_zooms(self, source, destination):
         """
         Merges source and destination metadata minzoom and maxzoom values.
         """
-        conn = sqlite3.connect(destination)
+        conn = self._connect(destination)
         cursor = conn.cursor()
         cursor.execute("ATTACH '%s' as db2" % (source))
         metadata = dict(cursor.execute("SELECT * FROM metadata"))
@@ -40,7 +67,7 @@ class MbtMerge(object):
         cursor.execute("UPDATE metadata SET value=:value WHERE name='maxzoom'", { "value": new_max_zoom })
         cursor.execute("DETACH db2")
         conn.commit()
-        conn.close()
+        self._close(conn)
 
     def _merge_metadata_bounds(self, source, destination):
         """
@@ -48,7 +75,7 @@ class MbtMerge(object):
         Creates the largest bounding box that contains both
         source and destination.
         """
-        conn = sqlite3.connect(destination)
+        conn = self._connect(destination)
         cursor = conn.cursor()
         cursor.execute("ATTACH '%s' as db2" % (source))
         metadata = dict(cursor.execute("SELECT * FROM metadata"))
@@ -70,7 +97,7 @@ class MbtMerge(object):
         cursor.execute('UPDATE metadata SET value=:value WHERE name="bounds"', { "value": new_bounds_str })
         cursor.execute("DETACH db2")
         conn.commit()
-        conn.close()
+        self._close(conn)
 
     def _merge_metadata_table(self, source, destination):
         """